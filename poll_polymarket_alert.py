@@ -1,16 +1,27 @@
 # Polymarket Trader Telegram Alert Bot (single-file simple version)
 # Save as poll_polymarket_alert.py
 
-import requests
-import time
+import asyncio
+import aiohttp
+import functools
 import json
-import threading
+import orjson
+import os
+import re
+import secrets
+import signal
+import time
+import websockets
+from aiohttp import web
+from collections import OrderedDict
 from pathlib import Path
-from datetime import datetime
 
 CONFIG_FILE = Path('config.json')
 SEEN_FILE = Path('seen_tx.json')
 SUBS_FILE = Path('subscriptions.json')
+# seen updates are appended here and folded into SEEN_FILE every SEEN_COMPACT_EVERY records
+SEEN_LOG = SEEN_FILE.with_suffix('.log')
+SEEN_COMPACT_EVERY = 1000
 
 # Load config
 if not CONFIG_FILE.exists():
@@ -24,153 +35,446 @@ API_KEY = cfg.get('polygonscan_api_key')
 TELEGRAM_BOT_TOKEN = cfg.get('telegram_bot_token')
 POLL_INTERVAL = int(cfg.get('poll_interval', 20))
 POLYDATA_API = cfg.get('polymarket_data_api', 'https://data-api.polymarket.com')
+# when set (public https base URL), receive updates via webhook instead of long-polling
+WEBHOOK_URL = cfg.get('webhook_url')
+WEBHOOK_PORT = int(os.environ.get('PORT', cfg.get('webhook_port', 8080)))
+WEBHOOK_SECRET = cfg.get('webhook_secret') or secrets.token_urlsafe(32)
+# when set (Alchemy Polygon wss URL), watch mined txs over a WebSocket instead of polling Polygonscan
+POLYGON_WS_URL = cfg.get('polygon_ws_url')
+# Alchemy caps one minedTransactions filter at 1000 entries; each address takes a from and a to entry
+WS_ADDRESSES_PER_SUBSCRIPTION = 500
 
 if not API_KEY or not TELEGRAM_BOT_TOKEN:
     print("Missing polygonscan_api_key or telegram_bot_token in config.json")
     raise SystemExit(1)
 
 BASE_TELEGRAM_URL = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}'
+WEI = 10**18
 
 # load or init storage
 if SEEN_FILE.exists():
     try:
-        with open(SEEN_FILE, 'r') as f:
-            seen = json.load(f)
+        with open(SEEN_FILE, 'rb') as f:
+            seen = orjson.loads(f.read())
     except:
         seen = {}
 else:
     seen = {}
 
+if SEEN_LOG.exists():
+    with open(SEEN_LOG, 'rb') as f:
+        for line in f:
+            try:
+                rec = orjson.loads(line)
+            except ValueError:
+                # torn final line from a crash mid-append
+                continue
+            if rec['hash'] is None:
+                # address dropped by its last subscriber
+                seen.pop(rec['addr'], None)
+            else:
+                seen[rec['addr']] = {'hash': rec['hash'], 'block': rec['block']}
+
+seen_log_fd = os.open(SEEN_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+seen_log_count = 0
+
 if SUBS_FILE.exists():
     try:
-        with open(SUBS_FILE, 'r') as f:
-            subs = json.load(f)
+        with open(SUBS_FILE, 'rb') as f:
+            subs = orjson.loads(f.read())
     except:
         subs = {}
 else:
     subs = {}
 
+# inverted index address -> chat ids, kept in sync by add/remove_subscription
+addr_to_chats = {}
+for cid, lst in subs.items():
+    for a in lst:
+        addr_to_chats.setdefault(a, set()).add(cid)
+# entries left behind by unfollows from older versions would replay stale blocks on re-follow
+for a in [a for a in seen if a not in addr_to_chats]:
+    del seen[a]
+
+# shared HTTP session, Polygonscan limiters, outbound Telegram queues, shutdown flag and
+# watched-address change flag, created inside the event loop by main()
+session = None
+POLYGON_SEMS = {}
+tg_queues = []
+stop_event = None
+addrs_changed = None
+
+# Polygonscan free tier allows 5 req/s. The budget is split into two lanes so user lookups
+# (/info) never queue behind a poll cycle: each lane spaces its requests (including retries)
+# to its own rate and caps its own requests in flight.
+POLYGON_LANE_RATES = {'poll': 3, 'interactive': 2}
+POLYGON_LANE_CONCURRENCY = {'poll': 5, 'interactive': 2}
+polygon_next_slot = {'poll': 0.0, 'interactive': 0.0}
+# new txs are paged through at most TXLIST_MAX_PAGES per address per poll cycle
+TXLIST_PAGE_SIZE = 100
+TXLIST_MAX_PAGES = 10
+# upstream GETs are retried on these statuses, connection errors and timeouts, with exponential
+# backoff (or Retry-After on 429, when longer)
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.3
+# outbound messages are sharded by chat over this many sender workers, which keeps
+# each chat's messages in order; each shard holds at most TG_QUEUE_MAXSIZE messages
+TG_WORKERS = 8
+TG_QUEUE_MAXSIZE = 1000
+
+# identical (chat_id, text) sends within this window are dropped
+TG_DEDUPE_WINDOW = 5
+recent_sends = {}
+
+# /info lookup caches: addr -> (value, fetched_at), LRU-bounded. Entries older than
+# their ttl are served stale while a background refresh runs, up to CACHE_MAX_STALE.
+CACHE_MAXSIZE = 10_000
+CACHE_MAX_STALE = 300
+BALANCE_TTL = 30
+TXS_TTL = 5
+balance_cache = OrderedDict()
+txs_cache = OrderedDict()
+cache_refreshes = {}
+
+ADDRESS_RE = re.compile(r'0x[0-9a-f]{40}')
+
 def norm_addr(a):
     return a.strip().lower()
 
-def polygonscan_txs_for_address(address, api_key, startblock=0, endblock=99999999):
-    url = 'https://api.polygonscan.com/api'
+def is_valid_addr(a):
+    return ADDRESS_RE.fullmatch(a) is not None
+
+def tx_hash_key(h):
+    # 32 raw bytes compare without any per-lookup case folding
+    try:
+        return bytes.fromhex(h.removeprefix('0x'))
+    except ValueError:
+        return h.lower()
+
+def fmt_matic(wei):
+    return f'{int(wei) / WEI:.6f}'
+
+async def wait_or_stop(seconds):
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+async def unless_stopped(coro):
+    # run coro, but give up on it (returning None) as soon as shutdown is requested
+    task = asyncio.ensure_future(coro)
+    stopper = asyncio.ensure_future(stop_event.wait())
+    done, _ = await asyncio.wait({task, stopper}, return_when=asyncio.FIRST_COMPLETED)
+    if task in done:
+        stopper.cancel()
+        return task.result()
+    task.cancel()
+    return None
+
+@functools.lru_cache(maxsize=4096)
+def fmt_tx_link_and_time(tx_hash, timestamp):
+    ts = time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(int(timestamp)))
+    return f'https://polygonscan.com/tx/{tx_hash}', ts
+
+# in-flight upstream requests by key; concurrent callers with the same key share one request
+inflight = {}
+
+async def single_flight(key, fetch):
+    fut = inflight.get(key)
+    if fut is None:
+        fut = asyncio.ensure_future(fetch())
+        inflight[key] = fut
+        def done(f):
+            if inflight.get(key) is f:
+                del inflight[key]
+            if not f.cancelled():
+                # mark as retrieved in case every caller was cancelled
+                f.exception()
+        fut.add_done_callback(done)
+    # shield so one caller being cancelled doesn't cancel the request for the others
+    return await asyncio.shield(fut)
+
+async def polygon_throttle(lane):
+    # reserve the next free slot before sleeping, so concurrent callers queue up behind each other
+    now = time.monotonic()
+    slot = max(now, polygon_next_slot[lane])
+    polygon_next_slot[lane] = slot + 1 / POLYGON_LANE_RATES[lane]
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+async def http_get(url, params, timeout, throttle=None):
+    for attempt in range(HTTP_RETRIES + 1):
+        last_try = attempt == HTTP_RETRIES
+        if throttle:
+            await throttle()
+        delay = HTTP_BACKOFF * 2 ** attempt
+        try:
+            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                if last_try or r.status not in HTTP_RETRY_STATUSES:
+                    r.raise_for_status()
+                    return await r.read()
+                if r.status == 429:
+                    try:
+                        delay = max(delay, float(r.headers.get('Retry-After', '')))
+                    except ValueError:
+                        # missing or an HTTP-date: keep the backoff delay
+                        pass
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if last_try:
+                raise
+        await asyncio.sleep(delay)
+
+async def polygonscan_get(params, timeout, interactive=False):
+    lane = 'interactive' if interactive else 'poll'
+    async def fetch():
+        async with POLYGON_SEMS[lane]:
+            body = await http_get('https://api.polygonscan.com/api', params, timeout,
+                                  throttle=functools.partial(polygon_throttle, lane))
+        return orjson.loads(body)
+    return await single_flight(('polygonscan',) + tuple(sorted(params.items())), fetch)
+
+async def polygonscan_txs_for_address(address, api_key, startblock=0, endblock=99999999, sort='asc', offset=100, page=1,
+                                      interactive=False):
     params = {
         'module': 'account',
         'action': 'txlist',
         'address': address,
         'startblock': startblock,
         'endblock': endblock,
-        'page': 1,
-        'offset': 100,
-        'sort': 'asc',
+        'page': page,
+        'offset': offset,
+        'sort': sort,
         'apikey': api_key
     }
-    r = requests.get(url, params=params, timeout=15)
-    r.raise_for_status()
-    data = r.json()
-    if data.get('status') != '1' or 'result' not in data:
+    data = await polygonscan_get(params, 15, interactive)
+    if data.get('status') == '1' and 'result' in data:
+        return data['result']
+    if data.get('message') == 'No transactions found':
         return []
-    return data['result']
+    # anything else (e.g. NOTOK "Max rate limit reached") is a failure, not an empty list
+    raise RuntimeError(f"Polygonscan txlist failed: {data.get('message')} {data.get('result')}")
 
-def polygonscan_balance(address, api_key):
-    url = 'https://api.polygonscan.com/api'
+async def polygonscan_balance(address, api_key, interactive=False):
     params = {'module':'account','action':'balance','address':address,'tag':'latest','apikey':api_key}
-    r = requests.get(url, params=params, timeout=10)
-    r.raise_for_status()
-    data = r.json()
+    data = await polygonscan_get(params, 10, interactive)
     if data.get('status') != '1' or 'result' not in data:
-        return None
-    bal = int(data['result']) / (10**18)
-    return bal
+        # raise rather than return None, so a NOTOK/rate-limit reply isn't cached as the balance
+        raise RuntimeError(f"Polygonscan balance failed: {data.get('message')} {data.get('result')}")
+    return int(data['result'])
 
-def polymarket_get_recent_trades_for_wallet(wallet_address, limit=5):
+async def polymarket_get_recent_trades_for_wallet(wallet_address, limit=5):
     url = f"{POLYDATA_API}/trades"
     params = {'proxyWallet': wallet_address, 'limit': limit}
-    try:
-        r = requests.get(url, params=params, timeout=10)
-        if r.status_code != 200:
+    async def fetch():
+        try:
+            body = await http_get(url, params, 10)
+            return orjson.loads(body) if body else []
+        except Exception:
             return []
-        return r.json() if r.text else []
+    return await single_flight(('trades', wallet_address, limit), fetch)
+
+async def polymarket_trades_by_hash(wallet_address, limit=50):
+    trade_by_hash = {}
+    try:
+        trades = await polymarket_get_recent_trades_for_wallet(wallet_address, limit=limit)
+        for t in trades:
+            if not t:
+                continue
+            txh = t.get('txHash') or t.get('transactionHash') or t.get('transaction_hash')
+            if txh:
+                trade_by_hash[tx_hash_key(txh)] = t
     except Exception:
-        return []
+        # unexpected response shape: alert without trade details rather than not at all
+        return {}
+    return trade_by_hash
 
-def match_tx_with_polymarket_trade(tx_hash, wallet_address):
-    trades = polymarket_get_recent_trades_for_wallet(wallet_address, limit=10)
-    for t in trades:
-        if not t:
-            continue
-        txh = t.get('txHash') or t.get('transactionHash') or t.get('transaction_hash')
-        if txh and txh.lower() == tx_hash.lower():
-            return t
-    return None
+async def send_telegram(chat_id, text, parse_mode='Markdown'):
+    now = time.monotonic()
+    key = (str(chat_id), text)
+    if now - recent_sends.get(key, float('-inf')) < TG_DEDUPE_WINDOW:
+        return
+    recent_sends[key] = now
+    if len(recent_sends) > 1000:
+        for k, t in list(recent_sends.items()):
+            if now - t >= TG_DEDUPE_WINDOW:
+                del recent_sends[k]
+    q = tg_queues[hash(key[0]) % len(tg_queues)]
+    try:
+        q.put_nowait((chat_id, text, parse_mode))
+    except asyncio.QueueFull:
+        # falling behind: drop the oldest queued message rather than block the caller
+        dropped = q.get_nowait()
+        q.task_done()
+        print('Telegram queue full, dropped message to', dropped[0])
+        q.put_nowait((chat_id, text, parse_mode))
 
-def send_telegram(chat_id, text, parse_mode='Markdown'):
+async def post_telegram(chat_id, text, parse_mode, max_attempts=5):
     url = f'{BASE_TELEGRAM_URL}/sendMessage'
     payload = {'chat_id': str(chat_id), 'text': text, 'parse_mode': parse_mode, 'disable_web_page_preview': True}
-    try:
-        r = requests.post(url, json=payload, timeout=10)
-        r.raise_for_status()
-    except Exception as e:
-        print('Failed to send telegram to', chat_id, e)
+    for attempt in range(max_attempts):
+        async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as r:
+            if r.status != 429:
+                r.raise_for_status()
+                return
+            data = orjson.loads(await r.read())
+            retry_after = data.get('parameters', {}).get('retry_after') or r.headers.get('Retry-After')
+        delay = float(retry_after) if retry_after else 2 ** attempt
+        print(f'Telegram flood limit for {chat_id}, retrying in {delay}s')
+        await asyncio.sleep(delay)
+    raise RuntimeError(f'gave up after {max_attempts} attempts (429)')
+
+async def telegram_sender(q):
+    while True:
+        chat_id, text, parse_mode = await q.get()
+        try:
+            await post_telegram(chat_id, text, parse_mode)
+        except Exception as e:
+            print('Failed to send telegram to', chat_id, e)
+        finally:
+            q.task_done()
 
-def get_updates(offset=None, timeout=30):
+# long-poll for 25s server-side with a 40s client socket timeout so slow handshakes don't cut it short
+async def get_updates(offset=None, timeout=25, http_timeout=40):
     url = f'{BASE_TELEGRAM_URL}/getUpdates'
-    params = {'timeout': timeout}
+    params = {'timeout': timeout, 'allowed_updates': '["message"]'}
     if offset:
         params['offset'] = offset
-    r = requests.get(url, params=params, timeout=timeout+10)
-    r.raise_for_status()
-    return r.json()
+    async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=http_timeout)) as r:
+        r.raise_for_status()
+        return orjson.loads(await r.read())
 
-def fmt_wallet_info(address):
-    addr = norm_addr(address)
-    bal = None
+async def refresh_cache(cache, key, fetch):
+    value = await fetch()
+    cache[key] = (value, time.monotonic())
+    cache.move_to_end(key)
+    while len(cache) > CACHE_MAXSIZE:
+        cache.popitem(last=False)
+    return value
+
+async def refresh_cache_quietly(cache, key, fetch):
     try:
-        bal = polygonscan_balance(addr, API_KEY)
-    except Exception:
+        await refresh_cache(cache, key, fetch)
+    except Exception as e:
+        print('Background refresh failed for', key, e)
+    finally:
+        cache_refreshes.pop((id(cache), key), None)
+
+async def cached_fetch(cache, key, ttl, fetch):
+    hit = cache.get(key)
+    if hit is None:
+        return await refresh_cache(cache, key, fetch)
+    value, fetched_at = hit
+    age = time.monotonic() - fetched_at
+    if age >= CACHE_MAX_STALE:
+        return await refresh_cache(cache, key, fetch)
+    cache.move_to_end(key)
+    rkey = (id(cache), key)
+    if age >= ttl and rkey not in cache_refreshes:
+        cache_refreshes[rkey] = asyncio.create_task(refresh_cache_quietly(cache, key, fetch))
+    return value
+
+async def fmt_wallet_info(address):
+    addr = norm_addr(address)
+    bal, txs = await asyncio.gather(
+        cached_fetch(balance_cache, addr, BALANCE_TTL, lambda: polygonscan_balance(addr, API_KEY, interactive=True)),
+        # newest first, and only as many rows as are shown
+        cached_fetch(txs_cache, addr, TXS_TTL,
+                     lambda: polygonscan_txs_for_address(addr, API_KEY, sort='desc', offset=5, interactive=True)),
+        return_exceptions=True)
+    if isinstance(bal, Exception):
         bal = None
-    try:
-        txs = polygonscan_txs_for_address(addr, API_KEY)
-    except Exception:
+    if isinstance(txs, Exception):
         txs = []
     msg = [f'*Wallet:* `{addr}`']
     if bal is not None:
-        msg.append(f'*Balance (MATIC):* {bal}')
+        msg.append(f'*Balance (MATIC):* {fmt_matic(bal)}')
     msg.append('*Recent transactions:*')
     if not txs:
         msg.append('_No recent transactions found or API returned empty._')
     else:
-        for tx in txs[-5:][::-1]:
-            ts = datetime.utcfromtimestamp(int(tx.get('timeStamp','0'))).strftime('%Y-%m-%d %H:%M:%S UTC')
+        for tx in txs:
             h = tx.get('hash')
+            link, ts = fmt_tx_link_and_time(h, tx.get('timeStamp','0'))
             frm = tx.get('from')
             to = tx.get('to')
-            val = int(tx.get('value','0'))/(10**18)
-            link = f'https://polygonscan.com/tx/{h}'
+            val = fmt_matic(tx.get('value','0'))
             msg.append(f'- {ts} | from `{frm}` → `{to}` | {val} MATIC | [tx]({link})')
     msg.append('\n_Send /follow <address> to subscribe to alerts for this address._')
     return '\n'.join(msg)
 
+def write_json_atomic(path, obj):
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(orjson.dumps(obj))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 def save_subs():
-    with open(SUBS_FILE, 'w') as f:
-        json.dump(subs, f)
+    write_json_atomic(SUBS_FILE, subs)
 
 def save_seen():
-    with open(SEEN_FILE, 'w') as f:
-        json.dump(seen, f)
+    # snapshot the full state, after which the journal can start over
+    global seen_log_count
+    write_json_atomic(SEEN_FILE, seen)
+    os.ftruncate(seen_log_fd, 0)
+    seen_log_count = 0
+
+def append_seen_log(addr, hash_, block):
+    global seen_log_count
+    rec = {'addr': addr, 'hash': hash_, 'block': block, 'ts': int(time.time())}
+    os.write(seen_log_fd, orjson.dumps(rec) + b'\n')
+    os.fsync(seen_log_fd)
+    seen_log_count += 1
+    if seen_log_count >= SEEN_COMPACT_EVERY:
+        save_seen()
+
+# hashes already handled in each address's seen block; seen itself only keeps the last one
+seen_block_hashes = {}
+
+def record_seen(addr, tx):
+    block = int(tx['blockNumber'])
+    last = seen.get(addr)
+    if not isinstance(last, dict) or last['block'] != block:
+        seen_block_hashes[addr] = set()
+    seen_block_hashes[addr].add(tx_hash_key(tx['hash']))
+    seen[addr] = {'hash': tx['hash'], 'block': block}
+    append_seen_log(addr, seen[addr]['hash'], seen[addr]['block'])
+
+def already_seen(addr, tx):
+    last = seen.get(addr)
+    if not isinstance(last, dict):
+        return False
+    block = int(tx['blockNumber'])
+    if block != last['block']:
+        return block < last['block']
+    hashes = seen_block_hashes.get(addr) or {tx_hash_key(last['hash'])}
+    return tx_hash_key(tx['hash']) in hashes
+
+def forget_seen(addr):
+    # a later re-follow then starts with a fresh initial sync instead of replaying the gap
+    seen_block_hashes.pop(addr, None)
+    if seen.pop(addr, None) is not None:
+        append_seen_log(addr, None, None)
 
 def add_subscription(chat_id, address):
     cid = str(chat_id)
     a = norm_addr(address)
+    if not is_valid_addr(a):
+        raise ValueError(f'not a Polygon address: {address}')
     lst = subs.get(cid, [])
     if a in lst:
         return False
     lst.append(a)
     subs[cid] = lst
     save_subs()
-    seen.setdefault(a, None)
-    save_seen()
+    if a not in addr_to_chats:
+        # newly watched: start from a fresh initial sync, whatever an in-flight fetch left behind
+        forget_seen(a)
+        seen[a] = None
+        addrs_changed.set()
+    addr_to_chats.setdefault(a, set()).add(cid)
     return True
 
 def remove_subscription(chat_id, address):
@@ -182,9 +486,16 @@ def remove_subscription(chat_id, address):
     lst.remove(a)
     subs[cid] = lst
     save_subs()
+    chats = addr_to_chats.get(a)
+    if chats is not None:
+        chats.discard(cid)
+        if not chats:
+            del addr_to_chats[a]
+            forget_seen(a)
+            addrs_changed.set()
     return True
 
-def process_update(u):
+async def process_update(u):
     if 'message' not in u:
         return
     m = u['message']
@@ -200,75 +511,138 @@ def process_update(u):
         arg = parts[1] if len(parts)>1 else None
         if cmd == '/help':
             help_text = ('Usage:\n/follow <address> - follow an address and receive alerts\n/unfollow <address> - stop following\n/list - list addresses you follow\n/info <address> - get wallet details now\nOr simply paste a Polygon wallet address to get details and follow prompt.')
-            send_telegram(chat_id, help_text)
+            await send_telegram(chat_id, help_text)
             return
         if cmd == '/follow' and arg:
+            if not is_valid_addr(norm_addr(arg)):
+                await send_telegram(chat_id, '⚠️ That is not a Polygon address (expected 0x followed by 40 hex characters).')
+                return
             added = add_subscription(chat_id, arg)
             if added:
-                send_telegram(chat_id, f'✅ Now following `{norm_addr(arg)}` for alerts.')
+                await send_telegram(chat_id, f'✅ Now following `{norm_addr(arg)}` for alerts.')
             else:
-                send_telegram(chat_id, f'ℹ️ `{norm_addr(arg)}` was already in your list.')
+                await send_telegram(chat_id, f'ℹ️ `{norm_addr(arg)}` was already in your list.')
             return
         if cmd == '/unfollow' and arg:
             removed = remove_subscription(chat_id, arg)
             if removed:
-                send_telegram(chat_id, f'🗑️ Unfollowed `{norm_addr(arg)}`')
+                await send_telegram(chat_id, f'🗑️ Unfollowed `{norm_addr(arg)}`')
             else:
-                send_telegram(chat_id, f'⚠️ `{norm_addr(arg)}` not found in your subscriptions.')
+                await send_telegram(chat_id, f'⚠️ `{norm_addr(arg)}` not found in your subscriptions.')
             return
         if cmd == '/list':
             lst = subs.get(str(chat_id), [])
             if not lst:
-                send_telegram(chat_id, 'You are not following any addresses.')
+                await send_telegram(chat_id, 'You are not following any addresses.')
             else:
-                send_telegram(chat_id, '*Your subscriptions:*\n' + '\n'.join([f'- `{a}`' for a in lst]))
+                await send_telegram(chat_id, '*Your subscriptions:*\n' + '\n'.join([f'- `{a}`' for a in lst]))
             return
         if cmd == '/info' and arg:
-            info = fmt_wallet_info(arg)
-            send_telegram(chat_id, info)
+            info = await fmt_wallet_info(arg)
+            await send_telegram(chat_id, info)
             return
-        send_telegram(chat_id, 'Unknown command. Send /help for usage.')
+        await send_telegram(chat_id, 'Unknown command. Send /help for usage.')
         return
     txt = text.strip()
     if txt.startswith('0x') and len(txt) >= 10:
-        info = fmt_wallet_info(txt)
-        send_telegram(chat_id, info)
-        send_telegram(chat_id, f'To receive ongoing alerts for this address, reply with `/follow {norm_addr(txt)}`')
+        info = await fmt_wallet_info(txt)
+        await send_telegram(chat_id, info)
+        await send_telegram(chat_id, f'To receive ongoing alerts for this address, reply with `/follow {norm_addr(txt)}`')
         return
-    send_telegram(chat_id, 'Send a Polygon wallet address (0x...) or /help for commands.')
+    await send_telegram(chat_id, 'Send a Polygon wallet address (0x...) or /help for commands.')
+
+async def telegram_call(method, **payload):
+    url = f'{BASE_TELEGRAM_URL}/{method}'
+    async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as r:
+        r.raise_for_status()
+        return orjson.loads(await r.read())
+
+update_tasks = set()
+
+async def process_update_logged(u):
+    try:
+        await process_update(u)
+    except Exception as e:
+        print('Error processing update', e)
+
+def dispatch_update(u):
+    # handle each update in its own task so one slow command (e.g. /info) doesn't hold up other chats
+    task = asyncio.create_task(process_update_logged(u))
+    update_tasks.add(task)
+    task.add_done_callback(update_tasks.discard)
 
-def telegram_listener():
+async def handle_webhook(request):
+    if request.match_info['secret'] != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    u = orjson.loads(await request.read())
+    # answer Telegram right away; the update is handled in the background
+    dispatch_update(u)
+    return web.Response()
+
+async def telegram_webhook():
+    print(f'Starting Telegram listener (webhook on port {WEBHOOK_PORT})...')
+    app = web.Application()
+    app.router.add_post('/telegram/{secret}', handle_webhook)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', WEBHOOK_PORT).start()
+    try:
+        delay = 1
+        while not stop_event.is_set():
+            try:
+                res = await telegram_call('setWebhook', url=f'{WEBHOOK_URL.rstrip("/")}/telegram/{WEBHOOK_SECRET}',
+                                          allowed_updates=['message'])
+                if res.get('ok'):
+                    break
+                print('setWebhook failed', res)
+            except Exception as e:
+                print('setWebhook error', e)
+            await wait_or_stop(delay)
+            delay = min(delay * 2, 60)
+        await stop_event.wait()
+    finally:
+        try:
+            await telegram_call('deleteWebhook')
+        except Exception as e:
+            print('deleteWebhook error', e)
+        await runner.cleanup()
+
+async def telegram_listener():
     print('Starting Telegram listener (long-poll getUpdates)...')
+    # getUpdates is refused while a webhook is registered, e.g. one left behind by a crashed webhook run
+    try:
+        await telegram_call('deleteWebhook')
+    except Exception as e:
+        print('deleteWebhook error', e)
     offset = None
-    while True:
+    while not stop_event.is_set():
         try:
-            res = get_updates(offset=offset, timeout=30)
+            res = await unless_stopped(get_updates(offset=offset))
+            if res is None:
+                break
             if not res.get('ok'):
-                time.sleep(1)
+                await wait_or_stop(1)
                 continue
             for u in res.get('result', []):
                 offset = u['update_id'] + 1
-                try:
-                    process_update(u)
-                except Exception as e:
-                    print('Error processing update', e)
+                dispatch_update(u)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            # an expired long-poll just means there were no messages
+            continue
         except Exception as e:
             print('getUpdates error', e)
-            time.sleep(5)
+            await wait_or_stop(5)
 
-def fmt_tx_message_for_subscribers(address, tx):
-    ts = datetime.utcfromtimestamp(int(tx.get('timeStamp','0'))).strftime('%Y-%m-%d %H:%M:%S UTC')
+def fmt_tx_message_for_subscribers(address, tx, trade_by_hash):
     hash_ = tx.get('hash')
+    link, ts = fmt_tx_link_and_time(hash_, tx.get('timeStamp','0'))
     to = tx.get('to')
     frm = tx.get('from')
-    value = int(tx.get('value','0'))/(10**18)
+    value = fmt_matic(tx.get('value','0'))
     input_data = tx.get('input')
-    link = f'https://polygonscan.com/tx/{hash_}'
-    trade = None
-    try:
-        trade = match_tx_with_polymarket_trade(hash_, address)
-    except Exception:
-        trade = None
+    trade = trade_by_hash.get(tx_hash_key(hash_)) if hash_ else None
     if trade:
         side = trade.get('side')
         price = trade.get('price')
@@ -291,54 +665,230 @@ def fmt_tx_message_for_subscribers(address, tx):
            f'_Raw input:_ `{input_data[:200]}`')
     return msg
 
-def poll_subscriptions():
-    print('Starting subscription poll loop...')
-    while True:
-        all_addresses = set()
-        for lst in subs.values():
-            for a in lst:
-                all_addresses.add(a)
-        for addr in list(all_addresses):
-            try:
-                txs = polygonscan_txs_for_address(addr, API_KEY)
-            except Exception as e:
-                print('Error fetching txs for', addr, e)
-                continue
-            if not txs:
+async def fetch_txs(addr):
+    last = seen.get(addr)
+    if not isinstance(last, dict):
+        # nothing recorded yet: only the newest tx is needed as a starting point
+        return await polygonscan_txs_for_address(addr, API_KEY, sort='desc', offset=1)
+    txs = []
+    for page in range(1, TXLIST_MAX_PAGES + 1):
+        try:
+            batch = await polygonscan_txs_for_address(addr, API_KEY, startblock=last['block'] + 1,
+                                                      offset=TXLIST_PAGE_SIZE, page=page)
+        except Exception as e:
+            if page == 1:
+                raise
+            # keep what was fetched, minus the last block which may be cut off; the rest comes next cycle
+            print('Error fetching txs page', page, 'for', addr, e)
+            tail_block = txs[-1]['blockNumber']
+            return [tx for tx in txs if tx['blockNumber'] != tail_block]
+        txs.extend(batch)
+        if len(batch) < TXLIST_PAGE_SIZE:
+            return txs
+    # page limit hit: the last block may be cut off, so leave it for the next cycle
+    # (unless it is the only block, in which case there is no other way to make progress)
+    tail_block = txs[-1]['blockNumber']
+    return [tx for tx in txs if tx['blockNumber'] != tail_block] or txs
+
+async def alert_subscribers(addr, tx, trade_by_hash):
+    if addr not in addr_to_chats:
+        # unfollowed meanwhile; recording it would undo forget_seen
+        return
+    msg = fmt_tx_message_for_subscribers(addr, tx, trade_by_hash)
+    for chat_id in tuple(addr_to_chats.get(addr, ())):
+        await send_telegram(chat_id, msg)
+    print('Alert sent for', addr, tx.get('hash'))
+    record_seen(addr, tx)
+
+def seen_changed(addr, before):
+    # unfollowed, re-followed or recorded elsewhere since `before` was read: the fetched txs are stale
+    return addr not in addr_to_chats or seen.get(addr) is not before
+
+async def poll_addresses(addrs):
+    before = {a: seen.get(a) for a in addrs}
+    # a full cycle can take minutes at the Polygonscan rate limit, so shutdown doesn't wait for it
+    results = await unless_stopped(asyncio.gather(*[fetch_txs(a) for a in addrs], return_exceptions=True))
+    if results is None:
+        return
+    for addr, txs in zip(addrs, results):
+        if stop_event.is_set():
+            return
+        if isinstance(txs, Exception):
+            print('Error fetching txs for', addr, txs)
+            continue
+        if not txs or seen_changed(addr, before[addr]):
+            continue
+        try:
+            # entries from older versions hold a bare hash; resync those like new ones
+            if not isinstance(seen.get(addr), dict):
+                record_seen(addr, txs[0])
+                print(f'Initial sync for {addr}, last tx {seen[addr]["hash"]}')
                 continue
-            last_seen = seen.get(addr)
-            if last_seen is None:
-                seen[addr] = txs[-1]['hash']
-                save_seen()
-                print(f'Initial sync for {addr}, last tx {seen[addr]}')
+            # txlist was queried from last block + 1, so every returned tx is new
+            # one trades lookup per wallet per cycle, shared by all of its new txs
+            trade_by_hash = await polymarket_trades_by_hash(addr)
+            if seen_changed(addr, before[addr]):
                 continue
-            seen_flag = False
-            new_list = []
             for tx in txs:
-                if tx['hash'] == last_seen:
-                    seen_flag = True
-                    continue
-                if seen_flag:
-                    new_list.append(tx)
-            if not seen_flag:
-                new_list = txs[-2:]
-            for tx in new_list:
-                msg = fmt_tx_message_for_subscribers(addr, tx)
-                for chat_id, lst in subs.items():
-                    if addr in lst:
-                        try:
-                            send_telegram(chat_id, msg)
-                        except Exception as e:
-                            print('Failed send to', chat_id, e)
-                print('Alert sent for', addr, tx.get('hash'))
-                seen[addr] = tx.get('hash')
-                save_seen()
-        time.sleep(POLL_INTERVAL)
+                await alert_subscribers(addr, tx, trade_by_hash)
+        except Exception as e:
+            print('Error processing txs for', addr, e)
+
+async def poll_subscriptions():
+    print('Starting subscription poll loop...')
+    while not stop_event.is_set():
+        await poll_addresses(list(addr_to_chats))
+        await wait_or_stop(POLL_INTERVAL)
+
+async def handle_mined_tx(note):
+    res = note.get('params', {}).get('result') or {}
+    tx = res.get('transaction')
+    if not tx or res.get('removed'):
+        return
+    # reshape the node's hex fields into the Polygonscan txlist format the formatter expects
+    tx = dict(tx, blockNumber=str(int(tx['blockNumber'], 16)), value=str(int(tx.get('value') or '0x0', 16)),
+              timeStamp=str(int(time.time())))
+    for addr in {norm_addr(tx.get('from') or ''), norm_addr(tx.get('to') or '')}:
+        if addr not in addr_to_chats:
+            continue
+        if already_seen(addr, tx):
+            # already alerted, e.g. by the backfill after (re)subscribing
+            continue
+        try:
+            trade_by_hash = await polymarket_trades_by_hash(addr)
+            await alert_subscribers(addr, tx, trade_by_hash)
+        except Exception as e:
+            print('Error processing mined tx for', addr, e)
+
+async def ws_reader(conn):
+    # the only place the socket is read: replies resolve their request, notifications are queued
+    async for raw in conn['ws']:
+        msg = orjson.loads(raw)
+        fut = conn['replies'].pop(msg.get('id'), None)
+        if fut is not None:
+            if not fut.done():
+                fut.set_result(msg)
+        elif msg.get('method') == 'eth_subscription':
+            conn['notes'].put_nowait(msg)
+    raise ConnectionError('Polygon WebSocket closed')
+
+async def ws_request(conn, method, params):
+    conn['next_id'] += 1
+    rid = conn['next_id']
+    fut = asyncio.get_running_loop().create_future()
+    conn['replies'][rid] = fut
+    await conn['ws'].send(orjson.dumps({'jsonrpc': '2.0', 'id': rid, 'method': method, 'params': params}).decode())
+    # don't hang on a reply that will never come because the reader died
+    await asyncio.wait({fut, conn['reader']}, return_when=asyncio.FIRST_COMPLETED)
+    if not fut.done():
+        conn['reader'].result()
+        raise ConnectionError('Polygon WebSocket closed')
+    msg = fut.result()
+    if 'error' in msg:
+        raise RuntimeError(msg['error'])
+    return msg['result']
+
+async def ws_subscribe(conn, addrs):
+    filters = [{'from': a} for a in addrs] + [{'to': a} for a in addrs]
+    sub_id = await ws_request(conn, 'eth_subscribe', ['alchemy_minedTransactions', {'addresses': filters}])
+    conn['chunks'].append((sub_id, set(addrs)))
+
+async def ws_sync_subscriptions(conn):
+    # bring the subscriptions in line with addr_to_chats; returns the newly watched addresses
+    wanted = {a for a in addr_to_chats if is_valid_addr(a)}
+    watched = set().union(*[addrs for _, addrs in conn['chunks']])
+    removed = watched - wanted
+    added = sorted(wanted - watched)
+    for chunk in [c for c in conn['chunks'] if c[1] & removed]:
+        # subscribe the remainder before dropping the old filter, so those addresses never go unwatched
+        remaining = sorted(chunk[1] - removed)
+        if remaining:
+            await ws_subscribe(conn, remaining)
+        await ws_request(conn, 'eth_unsubscribe', [chunk[0]])
+        conn['chunks'].remove(chunk)
+    for i in range(0, len(added), WS_ADDRESSES_PER_SUBSCRIPTION):
+        await ws_subscribe(conn, added[i:i + WS_ADDRESSES_PER_SUBSCRIPTION])
+    return added
+
+async def ws_session(ws):
+    conn = {'ws': ws, 'replies': {}, 'next_id': 0, 'notes': asyncio.Queue(), 'chunks': []}
+    conn['reader'] = asyncio.create_task(ws_reader(conn))
+    try:
+        addrs_changed.clear()
+        added = await ws_sync_subscriptions(conn)
+        # fresh stream: catch up every address on txs mined while we weren't subscribed;
+        # notifications keep being read into conn['notes'] meanwhile and are deduped afterwards
+        await poll_addresses(added)
+        while True:
+            getter = asyncio.ensure_future(conn['notes'].get())
+            wakeups = {asyncio.ensure_future(addrs_changed.wait()), asyncio.ensure_future(stop_event.wait())}
+            await asyncio.wait({getter, conn['reader']} | wakeups, return_when=asyncio.FIRST_COMPLETED)
+            for w in wakeups:
+                w.cancel()
+            if getter.done():
+                await handle_mined_tx(getter.result())
+            else:
+                getter.cancel()
+            if conn['reader'].done():
+                conn['reader'].result()
+            if stop_event.is_set():
+                return
+            if addrs_changed.is_set():
+                addrs_changed.clear()
+                # only newly watched addresses need a backfill; the other streams never broke
+                added = await ws_sync_subscriptions(conn)
+                await poll_addresses(added)
+    finally:
+        conn['reader'].cancel()
+
+async def polygon_ws_watcher():
+    print('Starting Polygon WebSocket watcher...')
+    while not stop_event.is_set():
+        if not any(is_valid_addr(a) for a in addr_to_chats):
+            await wait_or_stop(POLL_INTERVAL)
+            continue
+        try:
+            async with websockets.connect(POLYGON_WS_URL) as ws:
+                await ws_session(ws)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print('Polygon WebSocket error', e)
+            await wait_or_stop(5)
+
+async def main():
+    global session, POLYGON_SEMS, tg_queues, stop_event, addrs_changed
+    POLYGON_SEMS = {lane: asyncio.Semaphore(n) for lane, n in POLYGON_LANE_CONCURRENCY.items()}
+    tg_queues = [asyncio.Queue(maxsize=TG_QUEUE_MAXSIZE) for _ in range(TG_WORKERS)]
+    stop_event = asyncio.Event()
+    addrs_changed = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # not supported on Windows; Ctrl-C falls back to KeyboardInterrupt
+            pass
+    connector = aiohttp.TCPConnector(limit=50, limit_per_host=10)
+    async with aiohttp.ClientSession(connector=connector, json_serialize=lambda o: orjson.dumps(o).decode()) as s:
+        session = s
+        senders = [asyncio.create_task(telegram_sender(q)) for q in tg_queues]
+        try:
+            listener = telegram_webhook() if WEBHOOK_URL else telegram_listener()
+            watcher = polygon_ws_watcher() if POLYGON_WS_URL else poll_subscriptions()
+            await asyncio.gather(listener, watcher)
+            print('Stopping...')
+            try:
+                await asyncio.wait_for(asyncio.gather(*[q.join() for q in tg_queues]), timeout=10)
+            except asyncio.TimeoutError:
+                print('Dropping', sum(q.qsize() for q in tg_queues), 'unsent Telegram messages')
+        finally:
+            for sender in senders:
+                sender.cancel()
+            save_seen()
 
 if __name__ == '__main__':
-    t = threading.Thread(target=telegram_listener, daemon=True)
-    t.start()
     try:
-        poll_subscriptions()
+        asyncio.run(main())
     except KeyboardInterrupt:
         print('Stopping...')